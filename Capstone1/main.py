@@ -1,12 +1,24 @@
 import os
-import json
+import hashlib
+import io
+import itertools
 import logging
+import re
 import sqlite3
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+import numpy as np
+import orjson
 from dotenv import load_dotenv
-import requests
 import streamlit as st
 import google.generativeai as genai
 
+if TYPE_CHECKING:
+    import requests  # imported lazily in _http_session()
+
 # =========================
 #   Logging configuration
 # =========================
@@ -24,6 +36,7 @@ GOOGLE_API_KEY = os.getenv("google_api_key") or os.getenv("GOOGLE_API_KEY")
 TRELLO_API_KEY = os.getenv("TRELLO_API_KEY")
 TRELLO_TOKEN = os.getenv("TRELLO_TOKEN")
 TRELLO_LIST_ID = os.getenv("TRELLO_LIST_ID")
+TRELLO_ASYNC_TICKETS = os.getenv("TRELLO_ASYNC_TICKETS", "").lower() in ("1", "true", "yes")
 
 if not GOOGLE_API_KEY:
     raise RuntimeError(
@@ -86,62 +99,161 @@ Rules:
 - For movies, use the movies and directors tables (JOIN on movies.director_id = directors.id when needed).
 """.strip()
 
+# Built once per process; interned so repeated equality checks are cheap.
+SYSTEM_INSTRUCTION = sys.intern(
+    "You are a data insights assistant working with two local SQLite databases: "
+    "airports and movies. Use the provided tools to answer questions.\n\n"
+    + DB_SCHEMA_TEXT
+    + "\n\n"
+    "Safety rules:\n"
+    "- You must never write SQL that modifies data or schema. Only SELECT queries are allowed.\n"
+    "- If the user explicitly asks to contact support or if you cannot answer the question with "
+    "the available tools, suggest creating a support ticket and call the `create_support_ticket` tool "
+    "with a concise summary and details of the issue.\n"
+)
+
 
 # =========================
 #   DB helper functions
 # =========================
-def get_row_count_airports() -> int:
-    try:
-        conn = sqlite3.connect("db/airports.sqlite")
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM airports_code")
-        count = cur.fetchone()[0]
-        conn.close()
-        return count or 0
-    except Exception as e:
-        logging.error("Error counting airports rows: %s", e)
-        return 0
+AIRPORTS_DB_PATH = "db/airports.sqlite"
+MOVIES_DB_PATH = "db/movies.sqlite"
+
+
+# The databases are committed data files, so they are only ever opened read-only;
+# a large page cache plus mmap'd reads keep hot pages off the pread() path.
+_SQLITE_PRAGMAS = (
+    "PRAGMA cache_size=-65536",  # 64 MB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256 MB
+)
+
+
+def _read_only_uri(path: str) -> str:
+    return f"file:{path}?mode=ro"
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        _read_only_uri(path),
+        uri=True,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=512,
+    )
+    for pragma in _SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+@st.cache_resource(show_spinner=False)
+def _conn(path: str) -> sqlite3.Connection:
+    """
+    Return a long-lived connection for the given database file.
+
+    Streamlit re-executes this script on every rerun, so the connection is kept
+    in st.cache_resource instead of a module global. It is shared across the
+    script-runner threads, hence check_same_thread=False + _db_lock().
+    """
+    logging.info("Opening SQLite connection: %s", path)
+    return _open_connection(path)
 
 
-def get_row_count_movies() -> int:
+@st.cache_resource(show_spinner=False)
+def _stats_conn() -> sqlite3.Connection:
+    """
+    Connection used by the UI helpers: airports.sqlite with movies.sqlite
+    attached as "m", so both databases are read through a single connection.
+    """
+    logging.info("Opening SQLite stats connection: %s + %s", AIRPORTS_DB_PATH, MOVIES_DB_PATH)
+    conn = _open_connection(AIRPORTS_DB_PATH)
+    conn.execute("ATTACH DATABASE ? AS m", (_read_only_uri(MOVIES_DB_PATH),))
+    return conn
+
+
+@st.cache_resource(show_spinner=False)
+def _db_lock() -> threading.Lock:
+    """Lock guarding every statement run on the shared connections."""
+    return threading.Lock()
+
+
+# Indexes on the columns the model usually filters on. They are built into the
+# committed db files together with ANALYZE statistics; to rebuild a replaced db
+# file, run these statements and ANALYZE on it once.
+_INDEXES = {
+    AIRPORTS_DB_PATH: {
+        "idx_ap_country": "CREATE INDEX IF NOT EXISTS idx_ap_country ON airports_code(Country_Name)",
+        "idx_ap_city": "CREATE INDEX IF NOT EXISTS idx_ap_city ON airports_code(City_Name)",
+    },
+    MOVIES_DB_PATH: {
+        "idx_mv_date": "CREATE INDEX IF NOT EXISTS idx_mv_date ON movies(release_date)",
+        "idx_mv_vote": "CREATE INDEX IF NOT EXISTS idx_mv_vote ON movies(vote_average, vote_count)",
+        "idx_mv_dir": "CREATE INDEX IF NOT EXISTS idx_mv_dir ON movies(director_id)",
+    },
+}
+
+
+@st.cache_resource(show_spinner=False)
+def _check_indexes() -> None:
+    """Warn once per server process if a db file lacks the expected indexes."""
+    for path, indexes in _INDEXES.items():
+        try:
+            with _db_lock():
+                rows = _conn(path).execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index'"
+                ).fetchall()
+            missing = indexes.keys() - {name for (name,) in rows}
+            if missing:
+                logging.warning(
+                    "Missing indexes in %s: %s (queries fall back to table scans)",
+                    path, ", ".join(sorted(missing)),
+                )
+        except Exception as e:
+            logging.error("Error checking indexes for %s: %s", path, e)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_row_counts() -> tuple[int, int]:
+    """Return (airports rows, movies rows) with a single query."""
     try:
-        conn = sqlite3.connect("db/movies.sqlite")
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM movies")
-        count = cur.fetchone()[0]
-        conn.close()
-        return count or 0
+        with _db_lock():
+            cur = _stats_conn().cursor()
+            cur.execute(
+                "SELECT (SELECT COUNT(*) FROM airports_code), (SELECT COUNT(*) FROM m.movies)"
+            )
+            airports_count, movies_count = cur.fetchone()
+        return airports_count or 0, movies_count or 0
     except Exception as e:
-        logging.error("Error counting movies rows: %s", e)
-        return 0
+        logging.error("Error counting airports/movies rows: %s", e)
+        return 0, 0
 
 
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_sample_airports(limit: int = 5):
     try:
-        conn = sqlite3.connect("db/airports.sqlite")
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT Airport_Code, Airport_Name, City_Name, Country_Name FROM airports_code LIMIT ?",
-            (limit,),
-        )
-        rows = cur.fetchall()
-        conn.close()
+        with _db_lock():
+            cur = _stats_conn().cursor()
+            cur.execute(
+                "SELECT Airport_Code, Airport_Name, City_Name, Country_Name FROM airports_code LIMIT ?",
+                (limit,),
+            )
+            rows = cur.fetchall()
         return rows
     except Exception as e:
         logging.error("Error fetching sample airports: %s", e)
         return []
 
 
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_sample_movies(limit: int = 5):
     try:
-        conn = sqlite3.connect("db/movies.sqlite")
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT title, release_date, vote_average, vote_count FROM movies LIMIT ?",
-            (limit,),
-        )
-        rows = cur.fetchall()
-        conn.close()
+        with _db_lock():
+            cur = _stats_conn().cursor()
+            cur.execute(
+                "SELECT title, release_date, vote_average, vote_count FROM m.movies LIMIT ?",
+                (limit,),
+            )
+            rows = cur.fetchall()
         return rows
     except Exception as e:
         logging.error("Error fetching sample movies: %s", e)
@@ -151,39 +263,152 @@ def get_sample_movies(limit: int = 5):
 # =========================
 #   Tools (functions)
 # =========================
-def query_airports_db(query: str) -> str:
+MAX_RESULT_ROWS = 500
+# Unfiltered, unbounded full scans are rejected only on tables at least this
+# large (row counts come from sqlite_stat1, built into the db files by ANALYZE).
+FULL_SCAN_MAX_ROWS = 5_000  # airports_code (9,186 rows) is guarded; movies (4,773) is not
+_LIMIT_RE = re.compile(r"\blimit\s+(\d+)", re.IGNORECASE)
+_WHERE_RE = re.compile(r"\bwhere\b", re.IGNORECASE)
+_AGGREGATE_RE = re.compile(
+    r"\b(?:count|sum|avg|min|max|total|group_concat)\s*\(", re.IGNORECASE
+)
+# A terminating ";" plus any trailing whitespace and comments
+_TRAILING_SEMICOLON_RE = re.compile(r";(?:\s|--[^\n]*|/\*(?:(?!\*/).)*\*/)*$", re.DOTALL)
+_TABLE_ALIAS_RE = re.compile(
+    r"\b(?:from|join)\s+([A-Za-z_]\w*)(?:\s+(?:as\s+)?([A-Za-z_]\w*))?", re.IGNORECASE
+)
+_SQL_KEYWORDS = {
+    "where", "join", "inner", "left", "right", "cross", "natural", "outer", "full",
+    "on", "using", "group", "order", "limit", "having", "window", "union",
+    "except", "intersect",
+}
+
+
+def _large_tables(cursor: sqlite3.Cursor) -> set[str]:
+    try:
+        cursor.execute(
+            "SELECT tbl FROM sqlite_stat1 GROUP BY tbl HAVING MAX(CAST(stat AS INTEGER)) >= ?",
+            (FULL_SCAN_MAX_ROWS,),
+        )
+    except sqlite3.OperationalError:
+        # No ANALYZE statistics yet
+        return set()
+    return {row[0].lower() for row in cursor.fetchall()}
+
+
+def _is_bounded_query(query: str) -> bool:
     """
-    Execute a SQL query against db/airports.sqlite.
+    True if the query already keeps its result small: it filters (WHERE),
+    aggregates, or sets its own LIMIT within MAX_RESULT_ROWS.
+    """
+    if _WHERE_RE.search(query) or _AGGREGATE_RE.search(query):
+        return True
+    return any(int(n) <= MAX_RESULT_ROWS for n in _LIMIT_RE.findall(query))
 
-    SAFETY:
-    - Only SELECT queries are allowed. Any other query type will be rejected.
-    - This function should never modify schema or data.
+
+def _check_query_plan(cursor: sqlite3.Cursor, query: str) -> str | None:
     """
-    logging.info("Tool query_airports_db called with query: %s", query)
+    Return an error message if the plan full-scans a large table without an
+    index. Only called for unbounded queries (see _is_bounded_query), so the
+    model refines the query instead of pulling the whole table.
+    """
+    large_tables = _large_tables(cursor)
+    if not large_tables:
+        return None
+
+    aliases = {}
+    for table, alias in _TABLE_ALIAS_RE.findall(query):
+        aliases[table.lower()] = table.lower()
+        if alias and alias.lower() not in _SQL_KEYWORDS:
+            aliases[alias.lower()] = table.lower()
+
+    cursor.execute("EXPLAIN QUERY PLAN " + query)
+    for row in cursor.fetchall():
+        detail = row[-1]
+        if not detail.startswith("SCAN ") or "USING" in detail:
+            continue
+        name = detail.split()[1].lower()
+        if aliases.get(name, name) in large_tables:
+            return (
+                f"Error: query would return the whole large table '{aliases.get(name, name)}'; "
+                "add a WHERE clause or a LIMIT."
+            )
+    return None
+
+
+def _run_select_query(db_path: str, tool_name: str, query: str) -> str:
+    """
+    Run a read-only query and stream the rows into a JSON string:
+        {"columns": [...], "rows": [[...], ...], "truncated": bool}
+
+    Column names are sent once instead of being repeated in every row, which
+    roughly halves the payload (and Gemini input tokens). Rows are written one
+    by one into the buffer and capped at MAX_RESULT_ROWS.
+    """
+    db_label = os.path.basename(db_path)
 
     try:
         if not query.strip().lower().startswith("select"):
-            logging.warning("Rejected non-SELECT query in query_airports_db: %s", query)
+            logging.warning("Rejected non-SELECT query in %s: %s", tool_name, query)
             return "Error: Only SELECT queries are allowed."
 
-        conn = sqlite3.connect("db/airports.sqlite")
-        cursor = conn.cursor()
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        col_names = [desc[0] for desc in cursor.description] if cursor.description else []
-        conn.close()
-
-        if not rows:
-            logging.info("query_airports_db returned no results.")
+        bounded = _is_bounded_query(query)
+
+        if not _LIMIT_RE.search(query):
+            # One extra row lets us report that the result was truncated.
+            # Newlines keep a trailing "-- comment" from swallowing the ")".
+            inner = _TRAILING_SEMICOLON_RE.sub("", query.strip())
+            query = f"SELECT * FROM (\n{inner}\n) LIMIT {MAX_RESULT_ROWS + 1}"
+
+        buf = io.BytesIO()
+        row_count = 0
+        truncated = False
+
+        with _db_lock():
+            cursor = _conn(db_path).cursor()
+            plan_error = None if bounded else _check_query_plan(cursor, query)
+            if plan_error:
+                logging.warning("Rejected full-scan query in %s: %s", tool_name, query)
+                return plan_error
+            cursor.execute(query)
+            col_names = [desc[0] for desc in cursor.description] if cursor.description else []
+            buf.write(b'{"columns":')
+            buf.write(orjson.dumps(col_names))
+            buf.write(b',"rows":[')
+            for row in itertools.islice(cursor, MAX_RESULT_ROWS + 1):
+                if row_count == MAX_RESULT_ROWS:
+                    truncated = True
+                    break
+                if row_count:
+                    buf.write(b",")
+                buf.write(orjson.dumps(row))
+                row_count += 1
+
+        if not row_count:
+            logging.info("%s returned no results.", tool_name)
             return "No results found."
 
-        result = [dict(zip(col_names, row)) for row in rows]
-        logging.info("query_airports_db returned %d rows.", len(result))
-        return json.dumps(result, ensure_ascii=False)
+        buf.write(b'],"truncated":true}' if truncated else b'],"truncated":false}')
+        logging.info("%s returned %d rows (truncated=%s).", tool_name, row_count, truncated)
+        return buf.getvalue().decode("utf-8")
 
     except Exception as e:
-        logging.error("Error while querying airports.db: %s", e)
-        return f"Error while querying airports.db: {e}"
+        logging.error("Error while querying %s: %s", db_label, e)
+        return f"Error while querying {db_label}: {e}"
+
+
+def query_airports_db(query: str) -> str:
+    """
+    Execute a SQL query against db/airports.sqlite.
+
+    SAFETY:
+    - Only SELECT queries are allowed. Any other query type will be rejected.
+    - This function should never modify schema or data.
+    - Results come back as {"columns": [...], "rows": [[...], ...], "truncated": bool}.
+    - At most 500 rows are returned; "truncated" is true when more rows matched.
+    """
+    logging.info("Tool query_airports_db called with query: %s", query)
+    return _run_select_query(AIRPORTS_DB_PATH, "query_airports_db", query)
 
 
 def query_movies_db(query: str) -> str:
@@ -193,32 +418,52 @@ def query_movies_db(query: str) -> str:
     SAFETY:
     - Only SELECT queries are allowed. Any other query type will be rejected.
     - This function should never modify schema or data.
+    - Results come back as {"columns": [...], "rows": [[...], ...], "truncated": bool}.
+    - At most 500 rows are returned; "truncated" is true when more rows matched.
     """
     logging.info("Tool query_movies_db called with query: %s", query)
+    return _run_select_query(MOVIES_DB_PATH, "query_movies_db", query)
 
-    try:
-        if not query.strip().lower().startswith("select"):
-            logging.warning("Rejected non-SELECT query in query_movies_db: %s", query)
-            return "Error: Only SELECT queries are allowed."
 
-        conn = sqlite3.connect("db/movies.sqlite")
-        cursor = conn.cursor()
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        col_names = [desc[0] for desc in cursor.description] if cursor.description else []
-        conn.close()
+@st.cache_resource(show_spinner=False)
+def _http_session() -> "requests.Session":
+    """Keep-alive session so repeated Trello calls reuse the TLS connection."""
+    # Imported lazily: HTTP is only needed once a support ticket is created.
+    import requests
+
+    session = requests.Session()
+    session.mount(
+        "https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+    )
+    return session
+
+
+@st.cache_resource(show_spinner=False)
+def _io_pool() -> ThreadPoolExecutor:
+    """Worker threads for external I/O (Trello, future webhooks)."""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="io")
 
-        if not rows:
-            logging.info("query_movies_db returned no results.")
-            return "No results found."
 
-        result = [dict(zip(col_names, row)) for row in rows]
-        logging.info("query_movies_db returned %d rows.", len(result))
-        return json.dumps(result, ensure_ascii=False)
+def _parse_trello_response(response) -> str:
+    logging.info("Trello API status code: %s", response.status_code)
 
+    if response.status_code != 200:
+        logging.error("Trello API error: %s", response.text)
+        return f"Support ticket could not be created. Trello API error: {response.text}"
+
+    data = response.json()
+    card_id = data.get("id", "")
+    card_url = data.get("shortUrl") or data.get("url", "")
+    logging.info("Support ticket created: id=%s url=%s", card_id, card_url)
+
+    return f"Support ticket created successfully. Card ID: {card_id}, URL: {card_url}"
+
+
+def _log_queued_ticket(future: Future) -> None:
+    try:
+        _parse_trello_response(future.result())
     except Exception as e:
-        logging.error("Error while querying movies.db: %s", e)
-        return f"Error while querying movies.db: {e}"
+        logging.error("Error while creating queued Trello support ticket: %s", e)
 
 
 def create_support_ticket(summary: str, details: str | None = None) -> str:
@@ -255,25 +500,100 @@ def create_support_ticket(summary: str, details: str | None = None) -> str:
     }
 
     try:
-        response = requests.post(url, params=params, timeout=10)
-        logging.info("Trello API status code: %s", response.status_code)
-
-        if response.status_code != 200:
-            logging.error("Trello API error: %s", response.text)
-            return f"Support ticket could not be created. Trello API error: {response.text}"
-
-        data = response.json()
-        card_id = data.get("id", "")
-        card_url = data.get("shortUrl") or data.get("url", "")
-        logging.info("Support ticket created: id=%s url=%s", card_id, card_url)
+        if TRELLO_ASYNC_TICKETS:
+            # Optimistic confirmation: the outcome is only logged.
+            future = _io_pool().submit(_http_session().post, url, params=params, timeout=10)
+            future.add_done_callback(_log_queued_ticket)
+            logging.info("Support ticket queued: %s", summary)
+            return "Support ticket queued. It will appear in the Trello support list shortly."
 
-        return f"Support ticket created successfully. Card ID: {card_id}, URL: {card_url}"
+        return _parse_trello_response(_http_session().post(url, params=params, timeout=10))
 
     except Exception as e:
         logging.error("Error while creating Trello support ticket: %s", e)
         return f"Support ticket could not be created due to an internal error: {e}"
 
 
+# =========================
+#   Gemini model
+# =========================
+@st.cache_resource(show_spinner=False)
+def get_model() -> genai.GenerativeModel:
+    """
+    Gemini model with tools and safety instructions, shared by all sessions.
+    Each session only starts its own chat on top of it.
+    """
+    logging.info("Creating Gemini model instance.")
+    return genai.GenerativeModel(
+        model_name="gemini-2.5-flash",
+        tools=[query_airports_db, query_movies_db, create_support_ticket],
+        system_instruction=SYSTEM_INSTRUCTION,
+    )
+
+
+# =========================
+#   Reply cache helpers
+# =========================
+REPLY_CACHE_MAX_ENTRIES = 128
+# Prompts that may trigger side-effecting tools must always reach Gemini.
+UNCACHEABLE_KEYWORDS = ("create", "ticket")
+
+
+def reply_cache_key(user_input: str) -> str:
+    """Normalize the user prompt into an exact-match cache key."""
+    return hashlib.sha1(user_input.strip().lower().encode("utf-8")).hexdigest()
+
+
+def is_cacheable_prompt(user_input: str) -> bool:
+    text = user_input.lower()
+    return not any(word in text for word in UNCACHEABLE_KEYWORDS)
+
+
+def called_side_effect_tool(chat, history_start: int) -> bool:
+    """Check whether the last turn (chat.history[history_start:]) created a ticket."""
+    for content in chat.history[history_start:]:
+        for part in content.parts:
+            function_call = getattr(part, "function_call", None)
+            if function_call and function_call.name == "create_support_ticket":
+                return True
+    return False
+
+
+# =========================
+#   Semantic cache helpers
+# =========================
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+SEMANTIC_CACHE_MAX_ENTRIES = 256
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+
+@st.cache_resource(show_spinner=False)
+def get_embedding_model():
+    from sentence_transformers import SentenceTransformer
+
+    logging.info("Loading sentence embedding model: %s", EMBEDDING_MODEL_NAME)
+    return SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+
+
+def embed_prompt(user_input: str) -> np.ndarray:
+    # Normalized embeddings, so a dot product is the cosine similarity.
+    return get_embedding_model().encode(
+        user_input.strip(), normalize_embeddings=True, convert_to_numpy=True
+    )
+
+
+def lookup_semantic_cache(sem_cache: list, vec: np.ndarray) -> str | None:
+    if not sem_cache:
+        return None
+    mat = np.vstack([entry_vec for entry_vec, _ in sem_cache])
+    scores = np.dot(mat, vec)
+    best = int(np.argmax(scores))
+    if scores[best] > SEMANTIC_CACHE_THRESHOLD:
+        logging.info("Semantic cache hit (similarity=%.3f).", scores[best])
+        return sem_cache[best][1]
+    return None
+
+
 # =========================
 #   Streamlit UI
 # =========================
@@ -282,8 +602,8 @@ st.title("📊 Data Insights App — Gemini + SQLite + Trello")
 st.caption("Ask questions about airports or movies data. The assistant uses tools to query the database and can create support tickets in Trello when needed.")
 
 # Business info section (aggregated info + samples)
-airports_count = get_row_count_airports()
-movies_count = get_row_count_movies()
+_check_indexes()
+airports_count, movies_count = get_row_counts()
 
 col1, col2 = st.columns(2)
 with col1:
@@ -320,28 +640,16 @@ with st.expander("📌 Sample movies", expanded=False):
 if "history" not in st.session_state:
     st.session_state.history = []
 
-if "chat" not in st.session_state:
-    # Configure Gemini model with tools and safety instructions
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash",
-        tools=[query_airports_db, query_movies_db, create_support_ticket],
-        system_instruction=(
-            "You are a data insights assistant working with two local SQLite databases: "
-            "airports and movies. Use the provided tools to answer questions.\n\n"
-            + DB_SCHEMA_TEXT
-            + "\n\n"
-            "Safety rules:\n"
-            "- You must never write SQL that modifies data or schema. Only SELECT queries are allowed.\n"
-            "- If the user explicitly asks to contact support or if you cannot answer the question with "
-            "the available tools, suggest creating a support ticket and call the `create_support_ticket` tool "
-            "with a concise summary and details of the issue.\n"
-        ),
-    )
+if "reply_cache" not in st.session_state:
+    st.session_state.reply_cache = OrderedDict()
 
-    chat = model.start_chat(
+if "sem_cache" not in st.session_state:
+    st.session_state.sem_cache = []
+
+if "chat" not in st.session_state:
+    st.session_state.chat = get_model().start_chat(
         enable_automatic_function_calling=True
     )
-    st.session_state.chat = chat
 
 # Render existing chat history
 for msg in st.session_state.history:
@@ -359,21 +667,49 @@ if user_input:
         st.markdown(user_input)
 
     chat = st.session_state.chat
-
-    try:
-        response = chat.send_message(user_input)
-        # Log raw response object briefly
+    reply_cache = st.session_state.reply_cache
+    sem_cache = st.session_state.sem_cache
+    cacheable = is_cacheable_prompt(user_input)
+    cache_key = reply_cache_key(user_input)
+    bot_reply = None
+    prompt_vec = None
+
+    if cacheable and cache_key in reply_cache:
+        bot_reply = reply_cache[cache_key]
+        reply_cache.move_to_end(cache_key)
+        logging.info("Assistant reply served from cache.")
+    elif cacheable:
         try:
-            logging.debug("Raw Gemini response: %s", response.to_dict())
-        except Exception:
-            logging.debug("Raw Gemini response (repr): %r", response)
+            prompt_vec = embed_prompt(user_input)
+            bot_reply = lookup_semantic_cache(sem_cache, prompt_vec)
+        except Exception as e:
+            logging.error("Semantic cache lookup failed: %s", e)
 
-        bot_reply = response.text or "(Empty response)"
-        logging.info("Assistant reply: %s", bot_reply)
-
-    except Exception as e:
-        bot_reply = f"❌ Error from assistant: {e}"
-        logging.error("Error during Gemini chat: %s", e)
+    if bot_reply is None:
+        try:
+            history_start = len(chat.history)
+            response = chat.send_message(user_input)
+            # Log raw response object briefly
+            try:
+                logging.debug("Raw Gemini response: %s", response.to_dict())
+            except Exception:
+                logging.debug("Raw Gemini response (repr): %r", response)
+
+            bot_reply = response.text or "(Empty response)"
+            logging.info("Assistant reply: %s", bot_reply)
+
+            if cacheable and not called_side_effect_tool(chat, history_start):
+                reply_cache[cache_key] = bot_reply
+                if len(reply_cache) > REPLY_CACHE_MAX_ENTRIES:
+                    reply_cache.popitem(last=False)
+                if prompt_vec is not None:
+                    sem_cache.append((prompt_vec, bot_reply))
+                    if len(sem_cache) > SEMANTIC_CACHE_MAX_ENTRIES:
+                        sem_cache.pop(0)
+
+        except Exception as e:
+            bot_reply = f"❌ Error from assistant: {e}"
+            logging.error("Error during Gemini chat: %s", e)
 
     st.session_state.history.append({"role": "assistant", "content": bot_reply})
     with st.chat_message("assistant"):
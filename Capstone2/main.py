@@ -1,18 +1,18 @@
 import base64
-import hashlib
+import binascii
 import logging
 import os
-import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
+import diskcache
 import streamlit as st
+import xxhash
 from dotenv import load_dotenv
 from google import genai
 from streamlit_mic_recorder import mic_recorder
-import assemblyai as aai
 import PIL.Image as PILImage
-from bytez import Bytez  # Bytez SDK
 
 # ======================================
 # Logging configuration
@@ -44,7 +44,6 @@ if not ASSEMBLYAI_API_KEY:
         "AssemblyAI API key is missing. "
         "Set 'ASSEMBLYAI_API_KEY' in your environment or .env file."
     )
-aai.settings.api_key = ASSEMBLYAI_API_KEY
 
 # Bytez (LLM → image prompt)
 BYTEZ_API_KEY = os.getenv("BYTEZ_API_KEY") or os.getenv("bytez_api_key")
@@ -53,7 +52,6 @@ if not BYTEZ_API_KEY:
         "BYTEZ_API_KEY is missing. "
         "Set 'BYTEZ_API_KEY' in your environment or .env file."
     )
-bytez = Bytez(BYTEZ_API_KEY)
 BYTEZ_MODEL_ID = "openai/gpt-4o-mini"  # can be changed to "openai/gpt-4o" if needed
 
 
@@ -64,38 +62,38 @@ def transcribe_with_assemblyai(file_bytes: bytes) -> str:
     """
     Transcribe audio using AssemblyAI (synchronous).
     """
-    logging.info("Sending audio to AssemblyAI, size=%s bytes", len(file_bytes))
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-        tmp.write(file_bytes)
-        tmp_path = tmp.name
-
-    logging.info("Temporary audio file for AssemblyAI: %s", tmp_path)
+    # Imported lazily: the SDK is only needed once a recording is processed.
+    import assemblyai as aai
 
-    try:
-        transcriber = aai.Transcriber()
-        transcript = transcriber.transcribe(tmp_path)
+    aai.settings.api_key = ASSEMBLYAI_API_KEY
+    logging.info("Sending audio to AssemblyAI, size=%s bytes", len(file_bytes))
 
-        logging.info("AssemblyAI transcription status: %s", transcript.status)
-        if transcript.status != "completed":
-            raise RuntimeError(
-                f"Transcription failed: {transcript.status} ({transcript.error})"
-            )
+    # The SDK accepts a binary file-like object, so the audio never touches disk.
+    transcriber = aai.Transcriber()
+    transcript = transcriber.transcribe(BytesIO(file_bytes))
 
-        text = (transcript.text or "").strip()
-        logging.info("AssemblyAI transcript text: %s", text)
-        return text
+    logging.info("AssemblyAI transcription status: %s", transcript.status)
+    if transcript.status != "completed":
+        raise RuntimeError(
+            f"Transcription failed: {transcript.status} ({transcript.error})"
+        )
 
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+    text = (transcript.text or "").strip()
+    logging.info("AssemblyAI transcript text: %s", text)
+    return text
 
 
 # ======================================
 # Helper: text → image prompt via Bytez
 # ======================================
+@st.cache_resource(show_spinner=False)
+def get_bytez_client():
+    # Imported lazily: the SDK is only needed once a recording is processed.
+    from bytez import Bytez  # Bytez SDK
+
+    return Bytez(BYTEZ_API_KEY)
+
+
 def build_image_prompt_with_bytez(user_text: str) -> str:
     """
     Use Bytez (openai/gpt-4o-mini) to convert transcription text into
@@ -117,7 +115,7 @@ def build_image_prompt_with_bytez(user_text: str) -> str:
         "Output only the final English prompt, no explanations."
     )
 
-    model = bytez.model(BYTEZ_MODEL_ID)
+    model = get_bytez_client().model(BYTEZ_MODEL_ID)
 
     messages = [
         {"role": "system", "content": system_instruction},
@@ -206,12 +204,18 @@ def generate_image_with_gemini(prompt: str) -> PILImage.Image:
             if inline is None:
                 continue
 
+            # Skip text/other parts without decoding them
+            mime_type = getattr(inline, "mime_type", None) or ""
+            if mime_type and not mime_type.startswith("image/"):
+                continue
+
             data = getattr(inline, "data", None)
             if data is None:
                 continue
 
             logging.info(
-                "Got inline_data from Gemini: type=%s, len=%s",
+                "Got inline_data from Gemini: mime_type=%s, type=%s, len=%s",
+                mime_type or "n/a",
                 type(data),
                 len(data) if hasattr(data, "__len__") else "n/a",
             )
@@ -219,12 +223,11 @@ def generate_image_with_gemini(prompt: str) -> PILImage.Image:
             # 1) If it's already raw bytes — use as-is
             if isinstance(data, (bytes, bytearray)):
                 image_bytes = bytes(data)
-            # 2) If it's a string — try to decode as base64
+            # 2) If it's a string — decode as base64
             elif isinstance(data, str):
                 try:
                     image_bytes = base64.b64decode(data, validate=True)
-                    logging.info("inline_data.data successfully decoded as base64.")
-                except Exception as e:
+                except binascii.Error as e:
                     logging.warning(
                         "inline_data.data is str but not valid base64: %s. "
                         "Using raw bytes via latin1 encoding.",
@@ -232,25 +235,13 @@ def generate_image_with_gemini(prompt: str) -> PILImage.Image:
                     )
                     image_bytes = data.encode("latin1")
             else:
-                # Fallback: cast to str, then try base64
-                s = str(data)
-                try:
-                    image_bytes = base64.b64decode(s, validate=True)
-                    logging.info(
-                        "inline_data.data (non-typical type) decoded as base64 from str()."
-                    )
-                except Exception as e:
-                    logging.warning(
-                        "inline_data.data has unexpected type and cannot be decoded as base64: %s. "
-                        "Using raw string bytes.",
-                        e,
-                    )
-                    image_bytes = s.encode("latin1")
+                logging.warning("Skipping inline_data with unexpected type: %s", type(data))
+                continue
 
-            # Try to open as an image
+            # Only the header is parsed here; pixels are decoded lazily by
+            # whoever displays or re-encodes the image.
             try:
                 img = PILImage.open(BytesIO(image_bytes))
-                img.load()
                 logging.info("Image generation completed successfully.")
                 return img
             except Exception as e:
@@ -268,6 +259,54 @@ def generate_image_with_gemini(prompt: str) -> PILImage.Image:
         raise
 
 
+# ======================================
+# Helper: persistent pipeline cache
+# ======================================
+VOICE_CACHE_DIR = "./.voice_cache"
+VOICE_CACHE_SIZE_LIMIT = int(1e9)  # bytes
+
+
+@st.cache_resource(show_spinner=False)
+def get_voice_cache() -> diskcache.Cache:
+    """
+    On-disk cache shared by all sessions, so identical recordings never hit
+    AssemblyAI, Bytez or Gemini twice. Keys:
+        t:<audio hash>      -> transcript
+        p:<transcript hash> -> image prompt
+        i:<prompt hash>     -> JPEG bytes
+    """
+    logging.info("Opening voice cache at %s", VOICE_CACHE_DIR)
+    return diskcache.Cache(VOICE_CACHE_DIR, size_limit=VOICE_CACHE_SIZE_LIMIT)
+
+
+@st.cache_resource(show_spinner=False)
+def get_pipeline_executor() -> ThreadPoolExecutor:
+    """Worker threads for network calls that can overlap with a running stage."""
+    return ThreadPoolExecutor(max_workers=3, thread_name_prefix="voice-pipeline")
+
+
+def warm_up_gemini() -> None:
+    """
+    Cheap metadata call that opens the HTTPS connection to Gemini, so image
+    generation does not pay the handshake after STT and Bytez finish.
+    """
+    try:
+        gemini_client.models.get(model=IMAGE_MODEL)
+        logging.info("Gemini connection warmed up.")
+    except Exception as e:
+        logging.warning("Gemini warm-up failed: %s", e)
+
+
+def text_hash(text: str) -> str:
+    return xxhash.xxh3_128_hexdigest(text.encode("utf-8"))
+
+
+def image_to_jpeg_bytes(image: PILImage.Image) -> bytes:
+    buf = BytesIO()
+    image.convert("RGB").save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
 # ======================================
 # Streamlit UI
 # ======================================
@@ -333,7 +372,8 @@ if st.button("✨ Generate image", disabled=audio_bytes is None):
     elif not can_send:
         st.warning("Please wait a few seconds before sending another request.")
     else:
-        audio_hash = hashlib.sha256(audio_bytes).hexdigest()
+        # Non-cryptographic fingerprint: only used as a cache key.
+        audio_hash = xxhash.xxh3_128_hexdigest(audio_bytes)
 
         if (
             audio_hash == st.session_state.last_audio_hash
@@ -346,23 +386,46 @@ if st.button("✨ Generate image", disabled=audio_bytes is None):
             )
         else:
             try:
+                cache = get_voice_cache()
+
                 # 1) STT
-                with st.spinner("Transcribing audio with AssemblyAI..."):
-                    transcript = transcribe_with_assemblyai(audio_bytes)
-                    st.session_state.transcript = transcript
-                    logging.info("Final transcript: %s", transcript)
+                transcript = cache.get(f"t:{audio_hash}")
+                if transcript is None:
+                    # Uncached audio means the whole pipeline runs: warm up
+                    # Gemini while AssemblyAI is transcribing.
+                    get_pipeline_executor().submit(warm_up_gemini)
+                    with st.spinner("Transcribing audio with AssemblyAI..."):
+                        transcript = transcribe_with_assemblyai(audio_bytes)
+                    cache.set(f"t:{audio_hash}", transcript)
+                else:
+                    logging.info("Transcript loaded from disk cache.")
+                st.session_state.transcript = transcript
+                logging.info("Final transcript: %s", transcript)
 
                 # 2) LLM prompt (Bytez)
-                with st.spinner("Generating image prompt with Bytez..."):
-                    prompt = build_image_prompt_with_bytez(transcript)
-                    st.session_state.prompt = prompt
-                    logging.info("Final prompt (Bytez): %s", prompt)
+                prompt_key = f"p:{text_hash(transcript)}"
+                prompt = cache.get(prompt_key)
+                if prompt is None:
+                    with st.spinner("Generating image prompt with Bytez..."):
+                        prompt = build_image_prompt_with_bytez(transcript)
+                    cache.set(prompt_key, prompt)
+                else:
+                    logging.info("Image prompt loaded from disk cache.")
+                st.session_state.prompt = prompt
+                logging.info("Final prompt (Bytez): %s", prompt)
 
                 # 3) Image (Gemini)
-                with st.spinner("Generating image with Gemini..."):
-                    image = generate_image_with_gemini(prompt)
-                    st.session_state.image = image
-                    logging.info("Image stored in session_state.")
+                image_key = f"i:{text_hash(prompt)}"
+                image_bytes = cache.get(image_key)
+                if image_bytes is None:
+                    with st.spinner("Generating image with Gemini..."):
+                        image = generate_image_with_gemini(prompt)
+                    cache.set(image_key, image_to_jpeg_bytes(image))
+                else:
+                    logging.info("Image loaded from disk cache.")
+                    image = PILImage.open(BytesIO(image_bytes))
+                st.session_state.image = image
+                logging.info("Image stored in session_state.")
 
                 st.session_state.last_audio_hash = audio_hash
                 st.session_state.last_request_time = time.time()
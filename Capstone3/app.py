@@ -1,22 +1,45 @@
 import os
 import streamlit as st
 import asyncio
-import nest_asyncio
-
-# Apply nest_asyncio to allow nested event loops in Streamlit
-nest_asyncio.apply()
+import hashlib
+import json
+import logging
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
 
 from dotenv import load_dotenv
-from trello import TrelloClient
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+from requests.adapters import HTTPAdapter
+from trello import Board, List, TrelloClient
+import numpy as np
+try:
+    import faiss
+except ImportError:  # fall back to NumpySimpleVectorStore below
+    faiss = None
 
 from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage, Settings
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.postprocessor import LLMRerank
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode
 from llama_index.core.tools import FunctionTool
-# Workflow-based ReActAgent (default in 0.14.x)
-from llama_index.core.agent import ReActAgent
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores import SimpleVectorStore, VectorStoreQueryResult
+from llama_index.core.vector_stores.types import VectorStoreQueryMode
+# Workflow-based agents (default in 0.14.x)
+from llama_index.core.agent.workflow import AgentStream, FunctionAgent, ReActAgent
+from llama_index.core.agent.react import ReActChatFormatter
 from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.core.llms import ChatMessage
+from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.llms.gemini import Gemini
 from llama_index.embeddings.gemini import GeminiEmbedding
+from llama_index.vector_stores.faiss import FaissVectorStore
 
 # Load env variables
 load_dotenv()
@@ -30,46 +53,411 @@ try:
 except:
     llm = Gemini(model_name="models/gemini-1.5-flash")
 
-embed_model = GeminiEmbedding(model_name="models/text-embedding-004")
+# Large batches: an ingest needs a few embedding calls instead of one per chunk
+embed_model = GeminiEmbedding(model_name="models/text-embedding-004", embed_batch_size=100)
 
 Settings.llm = llm
 Settings.embed_model = embed_model
 
+# Async runtime: one long-lived loop on a daemon thread, shared by all sessions
+@st.cache_resource
+def get_event_loop():
+    """Return the background event loop that runs agent coroutines."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
 # Step B: Data Ingestion (RAG) - Cached globally
+EMBED_DIM = 768  # models/text-embedding-004
+FAISS_INDEX_FILE = "default__vector_store.json"  # name FaissVectorStore.persist() writes (binary FAISS)
+
+# IVFPQ (product quantization) once the corpus is big enough to train it:
+# 48 sub-quantizers x 8 bits = 48 bytes/vector instead of 3 KB float32.
+IVFPQ_NLIST = 256
+IVFPQ_MIN_TRAIN = IVFPQ_NLIST * 39  # FAISS wants ~39 training points per centroid
+IVFPQ_NPROBE = 16
+
+def new_faiss_index(num_vectors):
+    """Empty FAISS index sized for the corpus."""
+    # Gemini embeddings are unit-normalized, so inner product == cosine.
+    if num_vectors >= IVFPQ_MIN_TRAIN:
+        quantizer = faiss.IndexFlatIP(EMBED_DIM)
+        return faiss.IndexIVFPQ(
+            quantizer, EMBED_DIM, IVFPQ_NLIST, 48, 8, faiss.METRIC_INNER_PRODUCT
+        )
+    # Small corpus: HNSW graph instead of the brute-force SimpleVectorStore scan
+    faiss_index = faiss.IndexHNSWFlat(EMBED_DIM, 16, faiss.METRIC_INNER_PRODUCT)
+    faiss_index.hnsw.efConstruction = 100
+    faiss_index.hnsw.efSearch = 40
+    return faiss_index
+
+def faiss_mmap_flags(path):
+    """Read-only mmap flags for the persisted FAISS index at `path`."""
+    # IO_FLAG_MMAP maps IVF inverted lists; the flat vectors behind IndexHNSWFlat
+    # also need IO_FLAG_MMAP_IFC (faiss >= 1.11), which IVF indexes refuse.
+    # The file's fourcc header tells the two apart without loading the index.
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    with open(path, "rb") as f:
+        fourcc = f.read(4)
+    if fourcc == b"IHNf" and hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        flags |= faiss.IO_FLAG_MMAP_IFC
+    return flags
+
+def set_search_params(faiss_index):
+    if hasattr(faiss_index, "nprobe"):
+        faiss_index.nprobe = IVFPQ_NPROBE
+
+class NumpySimpleVectorStore(SimpleVectorStore):
+    """SimpleVectorStore that scores with one BLAS matrix-vector product."""
+
+    # (N, EMBED_DIM) float32, L2-normalized so dot == cosine; rebuilt lazily after writes
+    _matrix: np.ndarray | None = PrivateAttr(default=None)
+    _ids: list = PrivateAttr(default_factory=list)
+
+    def _invalidate(self):
+        self._matrix = None
+
+    def add(self, nodes, **add_kwargs):
+        ids = super().add(nodes, **add_kwargs)
+        self._invalidate()
+        return ids
+
+    def delete(self, ref_doc_id, **delete_kwargs):
+        super().delete(ref_doc_id, **delete_kwargs)
+        self._invalidate()
+
+    def delete_nodes(self, *args, **kwargs):
+        super().delete_nodes(*args, **kwargs)
+        self._invalidate()
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    def _build_matrix(self):
+        embedding_dict = self.data.embedding_dict
+        self._ids = list(embedding_dict)
+        if not self._ids:
+            self._matrix = np.empty((0, EMBED_DIM), dtype=np.float32)
+            return
+        matrix = np.array(list(embedding_dict.values()), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._matrix = matrix / norms
+
+    def query(self, query, **kwargs):
+        # Filters, node id restrictions and MMR keep the stock implementation
+        if (
+            query.filters is not None
+            or query.node_ids
+            or query.mode != VectorStoreQueryMode.DEFAULT
+            or query.query_embedding is None
+        ):
+            return super().query(query, **kwargs)
+
+        if self._matrix is None:
+            self._build_matrix()
+        if not self._ids:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_vec = np.asarray(query.query_embedding, dtype=np.float32)
+        query_vec /= np.linalg.norm(query_vec) or 1.0
+        scores = self._matrix @ query_vec
+        top_k = min(query.similarity_top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return VectorStoreQueryResult(
+            similarities=scores[top].tolist(), ids=[self._ids[i] for i in top]
+        )
+
+# Ingestion pipeline: batch -> concurrent embed workers -> single writer
+EMBED_BATCH_SIZE = 100
+EMBED_WORKERS = 4
+
+async def build_index(nodes, faiss_index, index):
+    """Embed nodes in concurrent batches while already-embedded batches are written."""
+    embed_queue = asyncio.Queue(maxsize=EMBED_WORKERS * 2)
+    write_queue = asyncio.Queue()
+
+    async def batch_chunks():
+        for i in range(0, len(nodes), EMBED_BATCH_SIZE):
+            await embed_queue.put(nodes[i:i + EMBED_BATCH_SIZE])
+        for _ in range(EMBED_WORKERS):
+            await embed_queue.put(None)
+
+    async def embed_worker():
+        while (batch := await embed_queue.get()) is not None:
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+            embeddings = await embed_model.aget_text_embedding_batch(texts)
+            for node, embedding in zip(batch, embeddings):
+                node.embedding = embedding
+            await write_queue.put(batch)
+
+    async def train(batch):
+        # FAISS releases the GIL, so training overlaps with embedding
+        vectors = np.array([node.embedding for node in batch], dtype="float32")
+        await asyncio.to_thread(faiss_index.train, vectors)
+
+    async def write_worker():
+        # One writer: the docstore and FAISS index are not safe for concurrent writes.
+        # IVFPQ has to be trained before vectors are added, so buffer until then.
+        pending = []
+        while (batch := await write_queue.get()) is not None:
+            if faiss_index is None or faiss_index.is_trained:
+                index.insert_nodes(batch)
+                continue
+            pending.extend(batch)
+            if len(pending) >= IVFPQ_MIN_TRAIN:
+                await train(pending)
+                index.insert_nodes(pending)
+                pending = []
+        if pending:
+            if not faiss_index.is_trained:
+                await train(pending)
+            index.insert_nodes(pending)
+
+    producers = [asyncio.create_task(batch_chunks())]
+    producers += [asyncio.create_task(embed_worker()) for _ in range(EMBED_WORKERS)]
+    writer = asyncio.create_task(write_worker())
+    try:
+        await asyncio.gather(*producers)
+        await write_queue.put(None)
+        await writer
+    finally:
+        # On failure (rate limit, network) nothing may stay parked on the shared loop
+        tasks = [*producers, writer]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+RAGDOCS_DIR = "ragdocs"
+# Separate dirs: the two backends persist incompatible vector store files
+STORAGE_DIR = "./storage" if faiss is not None else "./storage_numpy"
+FINGERPRINTS_FILE = "fingerprints.json"  # path -> {fingerprint: [mtime_ns, size], ref_doc_ids}
+
+def scan_ragdocs():
+    """Fingerprint every file SimpleDirectoryReader would pick up from RAGDOCS_DIR."""
+    fingerprints = {}
+    for entry in os.scandir(RAGDOCS_DIR):
+        if entry.is_file() and not entry.name.startswith("."):
+            stat = entry.stat()
+            fingerprints[entry.path] = [stat.st_mtime_ns, stat.st_size]
+    return fingerprints
+
+def load_nodes(paths):
+    """Chunk the given files; also returns the ref doc ids each file produced."""
+    splitter = SentenceSplitter(chunk_size=512)
+    nodes, ref_doc_ids = [], {}
+    for path in paths:
+        # filename_as_id: stable doc ids, so a file's nodes can be deleted later
+        documents = SimpleDirectoryReader(input_files=[path], filename_as_id=True).load_data()
+        ref_doc_ids[path] = [doc.doc_id for doc in documents]
+        nodes.extend(splitter.get_nodes_from_documents(documents))
+    return nodes, ref_doc_ids
+
 @st.cache_resource
 def get_index():
-    """Load and return index."""
-    storage_dir = "./storage"
-    
-    if os.path.exists(storage_dir):
-        storage_context = StorageContext.from_defaults(persist_dir=storage_dir)
-        index = load_index_from_storage(storage_context)
+    """Load the persisted index, embedding only ragdocs files changed since the last run."""
+    os.makedirs(RAGDOCS_DIR, exist_ok=True)
+    manifest_path = os.path.join(STORAGE_DIR, FINGERPRINTS_FILE)
+    current = scan_ragdocs()
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    added = [p for p in current if p not in manifest]
+    changed = [p for p in current if p in manifest and manifest[p]["fingerprint"] != current[p]]
+    stale = changed + [p for p in manifest if p not in current]
+
+    # No manifest (first start, or storage from before fingerprinting): nothing to diff against.
+    # FaissVectorStore cannot delete vectors, so changed/removed files mean a rebuild too.
+    rebuild = not os.path.exists(manifest_path) or (faiss is not None and bool(stale))
+
+    if rebuild:
+        nodes, ref_doc_ids = load_nodes(current)
+        if faiss is not None:
+            faiss_index = new_faiss_index(len(nodes))
+            set_search_params(faiss_index)
+            vector_store = FaissVectorStore(faiss_index=faiss_index)
+        else:
+            faiss_index = None
+            vector_store = NumpySimpleVectorStore()
+        index = VectorStoreIndex([], storage_context=StorageContext.from_defaults(vector_store=vector_store))
+        manifest = {}
     else:
-        # If ragdocs missing, create it
-        if not os.path.exists("ragdocs"):
-            os.makedirs("ragdocs")
-            
-        documents = SimpleDirectoryReader("ragdocs").load_data()
-        index = VectorStoreIndex.from_documents(documents)
-        index.storage_context.persist(persist_dir=storage_dir)
+        if faiss is None:
+            faiss_index = None
+            vector_store = NumpySimpleVectorStore.from_persist_dir(STORAGE_DIR)
+        else:
+            faiss_path = os.path.join(STORAGE_DIR, FAISS_INDEX_FILE)
+            if added:
+                faiss_index = faiss.read_index(faiss_path)  # writable: new vectors go in
+            else:
+                faiss_index = faiss.read_index(faiss_path, faiss_mmap_flags(faiss_path))
+            set_search_params(faiss_index)
+            vector_store = FaissVectorStore(faiss_index=faiss_index)
+        storage_context = StorageContext.from_defaults(
+            vector_store=vector_store, persist_dir=STORAGE_DIR
+        )
+        index = load_index_from_storage(storage_context)
+
+        # Only reached with the numpy store (stale files force a FAISS rebuild)
+        for path in stale:
+            for ref_doc_id in manifest.pop(path)["ref_doc_ids"]:
+                index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+        nodes, ref_doc_ids = load_nodes(added + changed)
+
+    if rebuild or added or stale:
+        asyncio.run_coroutine_threadsafe(
+            build_index(nodes, faiss_index, index), get_event_loop()
+        ).result()
+        # Persists the FAISS index next to the docstore
+        index.storage_context.persist(persist_dir=STORAGE_DIR)
+        for path, ids in ref_doc_ids.items():
+            manifest[path] = {"fingerprint": current[path], "ref_doc_ids": ids}
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, sort_keys=True)
+
+    # Warm-up: embedding client handshake + first retrieval happen at boot,
+    # not on the first user question. Retrieval only, so no LLM call is billed.
+    # Async on the background loop, like real queries, so the async client is the warm one.
+    try:
+        asyncio.run_coroutine_threadsafe(
+            index.as_retriever(similarity_top_k=1).aretrieve("warmup"), get_event_loop()
+        ).result(timeout=30)
+    except Exception:
+        logging.exception("Retrieval warm-up failed")
     
     return index
 
+# llama-index-core >= 0.14.24 reranks natively async (concurrent apredict batches).
+# Older releases inherit the base _apostprocess_nodes, which runs the sync
+# rerank inline and would block the shared loop (and every session) per LLM call.
+if LLMRerank._apostprocess_nodes is BaseNodePostprocessor._apostprocess_nodes:
+    class AsyncLLMRerank(LLMRerank):
+        """LLMRerank whose async path runs off the event loop."""
+
+        async def _apostprocess_nodes(self, nodes, query_bundle=None):
+            return await asyncio.to_thread(self._postprocess_nodes, nodes, query_bundle)
+else:
+    AsyncLLMRerank = LLMRerank
+
+@st.cache_resource
+def get_rag_engine():
+    """Retrieve 20 candidates, then let the LLM rerank them down to 5."""
+    return get_index().as_query_engine(
+        similarity_top_k=20,
+        node_postprocessors=[AsyncLLMRerank(top_n=5, llm=llm)]
+    )
+
 # Init index and engine
 index = get_index()
-rag_engine = index.as_query_engine(similarity_top_k=3)
+rag_engine = get_rag_engine()
+
+# Query cache: repeated questions skip embedding + retrieval + LLM entirely
+@st.cache_resource
+def get_index_version():
+    """Short hash of the ingest manifest; changes whenever ragdocs are re-ingested."""
+    with open(os.path.join(STORAGE_DIR, FINGERPRINTS_FILE), "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+INDEX_VERSION = get_index_version()  # part of every cache key, so stale answers are never served
+
+class QueryCache:
+    """Thread-safe LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_size=2000, ttl_seconds=600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+@st.cache_resource
+def get_query_cache():
+    """Shared by all sessions."""
+    return QueryCache()
+
+query_cache = get_query_cache()
 
 # Step C: Trello Integration
+TRELLO_API_URL = "https://api.trello.com/1"
+
+@st.cache_resource
+def get_trello_client():
+    """Trello client on a keep-alive session."""
+    # py-trello sends every call through http_service; a Session keeps the
+    # TCP+TLS connection alive between calls.
+    session = requests.Session()
+    session.headers.update({"Accept": "application/json"})
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+    return TrelloClient(
+        api_key=os.environ["TRELLO_API_KEY"],
+        token=os.environ["TRELLO_TOKEN"],
+        http_service=session
+    )
+
+def trello_batch(paths: list[str]) -> list:
+    """Run up to 10 GETs in one round trip via Trello's /1/batch endpoint."""
+    response = get_trello_client().http_service.get(
+        f"{TRELLO_API_URL}/batch",
+        params={
+            "urls": ",".join(paths),
+            "key": os.environ["TRELLO_API_KEY"],
+            "token": os.environ["TRELLO_TOKEN"],
+        },
+        timeout=10
+    )
+    response.raise_for_status()
+    # Each element is {"200": <body>} or an error object
+    results = []
+    for path, item in zip(paths, response.json()):
+        if "200" not in item:
+            raise RuntimeError(f"Trello batch request {path} failed: {item}")
+        results.append(item["200"])
+    return results
+
+@st.cache_resource
+def get_trello_list():
+    """Return the first open list of the support board, fetched once."""
+    board_id = os.environ["TRELLO_BOARD_ID"]
+    board_json, lists_json = trello_batch([f"/boards/{board_id}", f"/boards/{board_id}/lists"])
+    board = Board.from_json(trello_client=get_trello_client(), json_obj=board_json)
+    return List.from_json(board=board, json_obj=lists_json[0])
+
+@st.cache_resource
+def prefetch_trello():
+    """Fetch board metadata once at boot so the first ticket is a single POST."""
+    try:
+        get_trello_list()
+    except Exception:
+        pass  # Missing config/network errors surface when a ticket is created
+
+prefetch_trello()
+
 def create_ticket(user_name: str, user_email: str, summary: str, description: str) -> str:
     """Create a support ticket in Trello."""
     try:
-        client = TrelloClient(
-            api_key=os.environ["TRELLO_API_KEY"],
-            token=os.environ["TRELLO_TOKEN"]
-        )
-        board = client.get_board(os.environ["TRELLO_BOARD_ID"])
-        first_list = board.list_lists()[0]
-        card = first_list.add_card(
+        card = get_trello_list().add_card(
             name=summary,
             desc=f"Name: {user_name}\nEmail: {user_email}\n\n{description}"
         )
@@ -78,22 +466,34 @@ def create_ticket(user_name: str, user_email: str, summary: str, description: st
         return f"Error creating ticket: {str(e)}"
 
 # Step D: Agent Tools
-def search_knowledge_base(query: str) -> str:
+async def search_knowledge_base(query: str) -> str:
     """Search the Audi manuals for technical information."""
-    response = rag_engine.query(query)
+    key = f"{INDEX_VERSION}:{query.strip().lower()}"
+    cached = query_cache.get(key)
+    if cached is not None:
+        response_str, sources_str = cached
+        return f"Answer based on manuals: {response_str}\n\nSources:\n- {sources_str}"
+
+    # Async so several searches in one agent turn can run concurrently
+    response = await rag_engine.aquery(query)
     
-    sources = []
+    # Dict keys: de-duplicated in one pass, in retrieval order
+    seen = {}
     for node in response.source_nodes:
-        file_name = node.metadata.get("file_name", "Unknown File")
-        page_label = node.metadata.get("page_label", "?")
-        sources.append(f"{file_name} (Page {page_label})")
+        source = (node.metadata.get("file_name", "Unknown File"), node.metadata.get("page_label", "?"))
+        seen.setdefault(source, None)
     
-    unique_sources = list(set(sources))
-    sources_str = "\n- ".join(unique_sources) if unique_sources else "No specific page found."
+    sources_str = "\n- ".join(f"{f} (Page {p})" for f, p in seen) or "No specific page found."
+    query_cache.put(key, (str(response), sources_str))
     return f"Answer based on manuals: {str(response)}\n\nSources:\n- {sources_str}"
 
-ticket_tool = FunctionTool.from_defaults(fn=create_ticket)
-rag_tool = FunctionTool.from_defaults(fn=search_knowledge_base)
+@st.cache_resource
+def get_agent_tools():
+    """Build the tools once; from_defaults introspects signatures into pydantic schemas."""
+    return [
+        FunctionTool.from_defaults(fn=create_ticket),
+        FunctionTool.from_defaults(async_fn=search_knowledge_base),
+    ]
 
 SYSTEM_PROMPT = """
 You are an expert Audi Customer Support Agent.
@@ -106,12 +506,95 @@ Process:
 4. To create a ticket, ask for: Name, Email, Summary, Description.
 """
 
+@st.cache_resource
+def get_react_formatter():
+    """ReAct fallback: SYSTEM_PROMPT goes in as context below the ReAct instructions."""
+    return ReActChatFormatter.from_defaults(context=SYSTEM_PROMPT)
+
+# Step E: Chat history persistence (Parquet on disk, sliding window in memory)
+HISTORY_DIR = "./chat_history"
+HISTORY_WINDOW = 20  # messages kept in st.session_state.messages
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")  # uuid4().hex
+
+def get_session_id():
+    """Stable per-conversation id, kept in the URL so it survives restarts."""
+    # The id becomes a directory name: anything but our own uuid hex gets a fresh id
+    if not SESSION_ID_RE.match(st.query_params.get("sid", "")):
+        st.query_params["sid"] = uuid.uuid4().hex
+    return st.query_params["sid"]
+
+def append_history(session_id, messages):
+    """Write messages as a new Parquet part file (Parquet files are immutable)."""
+    session_dir = os.path.join(HISTORY_DIR, session_id)
+    os.makedirs(session_dir, exist_ok=True)
+    now = time.time()
+    table = pa.Table.from_pylist(
+        [{"ts": now, "seq": i, "role": m["role"], "content": m["content"]} for i, m in enumerate(messages)]
+    )
+    pq.write_table(table, os.path.join(session_dir, f"{time.time_ns()}.parquet"))
+
+def load_history(session_id):
+    """Return all stored messages of a session, oldest first."""
+    session_dir = os.path.join(HISTORY_DIR, session_id)
+    if not os.path.isdir(session_dir):
+        return []
+    try:
+        table = pq.read_table(session_dir).sort_by([("ts", "ascending"), ("seq", "ascending")])
+        return table.select(["role", "content"]).to_pylist()
+    except Exception:
+        logging.exception("Could not load chat history for session %s", session_id)
+        return []
+
 # --- UI LOGIC ---
 
 st.title("🚗 Audi Support Agent")
 
+if st.button("Reset conversation"):
+    for key in ("agent", "agent_memory", "messages", "hidden_messages"):
+        st.session_state.pop(key, None)
+    st.query_params["sid"] = uuid.uuid4().hex
+
+session_id = get_session_id()
+
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    stored = load_history(session_id)
+    st.session_state.messages = stored[-HISTORY_WINDOW:]
+    st.session_state.hidden_messages = len(stored) - len(st.session_state.messages)
+
+# Build the agent once per session; its memory accumulates turn-to-turn
+AGENT_MEMORY_WINDOW = 20  # messages kept in agent memory
+STREAM_DONE = object()  # end-of-stream sentinel between the event loop and the UI thread
+if "agent" not in st.session_state:
+    # Native Gemini function calling skips the verbose ReAct scratchpad;
+    # ReAct is only the fallback for models without tool calling.
+    if llm.metadata.is_function_calling_model:
+        st.session_state.agent = FunctionAgent(
+            tools=get_agent_tools(),
+            llm=llm,
+            timeout=120,
+            system_prompt=SYSTEM_PROMPT
+        )
+    else:
+        st.session_state.agent = ReActAgent(
+            tools=get_agent_tools(),
+            llm=llm,
+            timeout=120,
+            formatter=get_react_formatter()
+        )
+    # Seeded from the restored window so a reloaded conversation keeps its context
+    st.session_state.agent_memory = ChatMemoryBuffer.from_defaults(
+        chat_history=[
+            ChatMessage(role=m["role"], content=m["content"])
+            for m in st.session_state.messages[-AGENT_MEMORY_WINDOW:]
+        ],
+        token_limit=4096
+    )
+
+# Older messages live on disk and are only loaded on demand
+if st.session_state.hidden_messages > 0:
+    if st.button(f"Show {st.session_state.hidden_messages} earlier messages"):
+        st.session_state.messages = load_history(session_id)
+        st.session_state.hidden_messages = 0
 
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -119,47 +602,66 @@ for message in st.session_state.messages:
 
 if prompt := st.chat_input("Ask about your Audi (e.g., 'How to check oil in A4?')"):
     st.session_state.messages.append({"role": "user", "content": prompt})
+    turn = [{"role": "user", "content": prompt}]
     with st.chat_message("user"):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.spinner("Analyzing manuals..."):
-            
-            # Helper to run async agent
-            async def run_agent_interaction(user_prompt, history):
-                # Build chat history for memory
-                chat_history = [
-                    ChatMessage(role=m["role"], content=m["content"])
-                    for m in history
-                ]
-                memory = ChatMemoryBuffer.from_defaults(chat_history=chat_history)
-
-                # Initialize Workflow Agent (ReActAgent in 0.14.x)
-                # Note: 'system_prompt' might need to be passed via Context depending on version, 
-                # but constructor usually accepts it or 'description'. 
-                # ReActAgent(tools, llm, memory, ...)
-                agent = ReActAgent(
-                    tools=[ticket_tool, rag_tool],
-                    llm=llm,
-                    memory=memory,
-                    timeout=120,
-                    system_prompt=SYSTEM_PROMPT
-                )
-                
-                return await agent.run(user_msg=user_prompt)
-
-            # Execution with loop handling
+        # Helper to run async agent; pushes text deltas to `deltas` while it runs
+        async def run_agent_interaction(agent, memory, user_prompt, deltas=None):
             try:
-                try:
-                    loop = asyncio.get_event_loop()
-                except RuntimeError:
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                
-                response = loop.run_until_complete(run_agent_interaction(prompt, st.session_state.messages[:-1]))
-                
+                handler = agent.run(user_msg=user_prompt, memory=memory)
+                if deltas is not None:
+                    async for event in handler.stream_events():
+                        if isinstance(event, AgentStream) and event.delta:
+                            deltas.put(event.delta)
+                response = await handler
+            finally:
+                if deltas is not None:
+                    deltas.put(STREAM_DONE)
+            # Rolling window: keep the stored history O(1) in the number of turns
+            history = memory.get_all()
+            if len(history) > AGENT_MEMORY_WINDOW:
+                # Start on a user message: a leading tool result or tool-call
+                # message without its pair is rejected by Gemini next turn.
+                user_starts = [i for i, m in enumerate(history) if m.role == MessageRole.USER]
+                cut = len(history) - AGENT_MEMORY_WINDOW
+                cut = next((i for i in user_starts if i >= cut), user_starts[-1] if user_starts else cut)
+                memory.set(history[cut:])
+            return response
+
+        def iter_deltas(deltas):
+            while (delta := deltas.get(timeout=130)) is not STREAM_DONE:
+                yield delta
+
+        try:
+            # ReAct deltas include the Thought/Action scratchpad, so only FunctionAgent streams
+            streaming = isinstance(st.session_state.agent, FunctionAgent)
+            deltas = queue.Queue() if streaming else None
+            future = asyncio.run_coroutine_threadsafe(
+                run_agent_interaction(
+                    st.session_state.agent, st.session_state.agent_memory, prompt, deltas
+                ),
+                get_event_loop()
+            )
+            if streaming:
+                st.write_stream(iter_deltas(deltas))
+                response = future.result(timeout=130)
+            else:
+                with st.spinner("Analyzing manuals..."):
+                    response = future.result(timeout=130)
                 st.markdown(response.response)
-                st.session_state.messages.append({"role": "assistant", "content": str(response.response)})
 
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
\ No newline at end of file
+            st.session_state.messages.append({"role": "assistant", "content": str(response.response)})
+            turn.append({"role": "assistant", "content": str(response.response)})
+
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
+
+    append_history(session_id, turn)
+
+    # Keep only the sliding window in session state; the rest stays on disk
+    overflow = len(st.session_state.messages) - HISTORY_WINDOW
+    if overflow > 0:
+        del st.session_state.messages[:overflow]
+        st.session_state.hidden_messages += overflow